@@ -2,6 +2,8 @@ import firebase_admin
 import streamlit as st
 import os
 import json
+import logging
+import threading
 from firebase_admin import initialize_app, credentials, firestore, exceptions
 from datetime import datetime, date, timedelta
 import pandas as pd
@@ -9,10 +11,10 @@ import bcrypt
 from functools import lru_cache 
 import io 
 
+logger = logging.getLogger(__name__)
+
 # --- CONSTANTES ---
-# NOTE: Vous devez avoir ici vos constantes (COL_USERS, ROLES, DEFAULT_PASSWORD, etc.)
-COL_USERS = "smmd_users" # Exemple de constante
-ROLES = ["admin", "superviseur", "utilisateur"] # Exemple de constante
+# NOTE: Les constantes de l'application (COL_USERS, ROLES, DEFAULT_PASSWORD, etc.) sont définies en section 2.
 
 # --- FONCTION D'INITIALISATION FIREBASE (VERSION FINALE ROBUSTE) ---
 
@@ -45,7 +47,21 @@ def get_firebase_credentials():
     return None
 
 
-# 2. Fonction d'initialisation principale
+# 2. Création du client, partagée par toutes les sessions et toutes les réexécutions du script
+@st.cache_resource(show_spinner=False)
+def create_firestore_client(_cred_dict):
+    """Crée une seule fois par processus le certificat, l'application Firebase et le client Firestore (et son canal gRPC)."""
+    cred = credentials.Certificate(_cred_dict)
+
+    try:
+        app_instance = firebase_admin.get_app() 
+    except ValueError:
+        app_instance = initialize_app(cred)
+        
+    return firestore.client(app=app_instance)
+
+
+# 3. Fonction d'initialisation principale
 def initialize_firebase_connection():
     """Initialise Firebase et retourne le client Firestore."""
     
@@ -53,18 +69,9 @@ def initialize_firebase_connection():
     if cred_dict is None:
         return None
         
-    # Le reste de la logique est maintenant sécurisé
+    # Le reste de la logique est maintenant sécurisé (une exception n'est pas mise en cache)
     try:
-        cred = credentials.Certificate(cred_dict)
-
-        try:
-            app_instance = firebase_admin.get_app() 
-        except ValueError:
-            app_instance = initialize_app(cred)
-            
-        db_client = firestore.client(app=app_instance)
-        
-        return db_client
+        return create_firestore_client(cred_dict)
     except Exception as e:
         st.error(f"Erreur fatale lors de l'initialisation du certificat : {e}")
         return None
@@ -89,13 +96,44 @@ COL_USERS = 'smmd_users'
 COL_ALLOCATIONS = 'smmd_allocations' 
 COL_CATEGORIES = 'smmd_categories' 
 
-PAYMENT_METHODS_HOUSE = ['CB Maison', 'Virement Maison']
-PAYMENT_METHODS_PERSONAL = ['CB Perso', 'Chèque', 'Liquide', 'Virement Perso', 'Autre Personnel']
+PAYMENT_METHODS_HOUSE = ('CB Maison', 'Virement Maison')
+PAYMENT_METHODS_PERSONAL = ('CB Perso', 'Chèque', 'Liquide', 'Virement Perso', 'Autre Personnel')
 PAYMENT_METHODS = PAYMENT_METHODS_HOUSE + PAYMENT_METHODS_PERSONAL 
 
-ROLES = ['admin', 'utilisateur', 'chef_de_maison']
+# Classification d'une dépense selon son moyen de paiement : (type Firestore, statut de l'avance)
+PAYMENT_METHOD_CLASSIFICATION = {
+    **{method: ('depense_commune', 'validée') for method in PAYMENT_METHODS_HOUSE},
+    **{method: ('depense_avance', 'en_attente') for method in PAYMENT_METHODS_PERSONAL},
+}
+
+ROLES = ('admin', 'utilisateur', 'chef_de_maison')
 DEFAULT_PASSWORD = "first123" 
 
+# Facteur de coût bcrypt (12 = défaut de la librairie ; au moins 10 en production,
+# 4 minimum accepté par bcrypt uniquement si BCRYPT_ALLOW_LOW_COST=1, pour le développement)
+BCRYPT_DEFAULT_COST = 12
+BCRYPT_MIN_PROD_COST = 10
+
+def read_bcrypt_cost():
+    """Lit et valide BCRYPT_COST une seule fois au chargement (repli sur le défaut si invalide)."""
+    raw_cost = os.environ.get('BCRYPT_COST', str(BCRYPT_DEFAULT_COST))
+    try:
+        cost = int(raw_cost)
+    except ValueError:
+        logger.warning("BCRYPT_COST invalide (%r) : utilisation de %d", raw_cost, BCRYPT_DEFAULT_COST)
+        return BCRYPT_DEFAULT_COST
+    min_cost = 4 if os.environ.get('BCRYPT_ALLOW_LOW_COST') == '1' else BCRYPT_MIN_PROD_COST
+    clamped_cost = min(max(cost, min_cost), 31)
+    if clamped_cost != cost:
+        logger.warning("BCRYPT_COST=%d hors de l'intervalle [%d, 31] : utilisation de %d", cost, min_cost, clamped_cost)
+    return clamped_cost
+
+BCRYPT_COST = read_bcrypt_cost()
+
+# Limitation des tentatives de connexion par nom d'utilisateur, pour tout le processus (chaque essai coûte un calcul bcrypt)
+LOGIN_MAX_ATTEMPTS = 5
+LOGIN_LOCKOUT_SECONDS = 60
+
 AVANCE_STATUS = {
     'en_attente': 'En attente de validation',
     'validée': 'Validée',
@@ -119,11 +157,12 @@ def get_categories():
     """Récupère et cache toutes les catégories depuis Firestore."""
     if not db: return {} # type: ignore
     try:
-        docs = db.collection(COL_CATEGORIES).stream() # type: ignore
+        docs = db.collection(COL_CATEGORIES).select(['name']).stream() # type: ignore
         # Assurez-vous que l'ID du document est la clé et le 'name' la valeur
         categories = {doc.id: doc.to_dict().get('name', 'N/A') for doc in docs}
         return categories
     except Exception:
+        logger.exception("Erreur lors du chargement des catégories")
         return {} 
 
 @st.cache_data(ttl=3600)
@@ -131,34 +170,29 @@ def get_house_name(house_id):
     """Retourne le nom de la maison depuis Firestore."""
     if not db or not house_id: return "Maison Inconnue"
     try:
-        doc = db.collection(COL_HOUSES).document(house_id).get()
+        doc = db.collection(COL_HOUSES).document(house_id).get(field_paths=['name'])
         return doc.to_dict().get('name', 'Maison Inconnue') if doc.exists else 'Maison Inconnue'
     except Exception:
+        logger.exception("Erreur lors du chargement de la maison %s", house_id)
         return "Maison Inconnue"
 
 @st.cache_data(ttl=3600)
 def get_all_users_for_house(house_id):
-    """Récupère tous les utilisateurs d'une maison (pour les jointures et la connexion)."""
+    """Récupère les noms de tous les utilisateurs d'une maison (pour les jointures)."""
     if not db or not house_id: return {}
     try:
-        docs = db.collection(COL_USERS).where('house_id', '==', house_id).stream()
+        # Projection sur les noms : les hash de mot de passe ne transitent pas et ne sont pas mis en cache
+        docs = db.collection(COL_USERS).where('house_id', '==', house_id).select(['first_name', 'last_name']).stream()
         users = {doc.id: doc.to_dict() for doc in docs}
         return users
     except Exception:
+        logger.exception("Erreur lors du chargement des utilisateurs de la maison %s", house_id)
         return {}
     
-def get_user_name_by_id(user_id):
-    """Récupère le prénom et nom d'un utilisateur par ID (utilise les données mises en cache si possible)."""
-    # Si l'utilisateur actuel est celui demandé
-    if user_id == st.session_state.get('user_id'):
-        data = st.session_state.get('user_data', {})
-        return f"{data.get('first_name', 'Utilisateur')} {data.get('last_name', '')}".strip()
-        
-    # Sinon, on doit charger les utilisateurs de la maison
-    house_id = st.session_state.get('house_id')
-    users_data = get_all_users_for_house(house_id)
-    user_info = users_data.get(user_id, {})
-    return f"{user_info.get('first_name', 'Utilisateur')} {user_info.get('last_name', '')}".strip()
+def format_user_name(user_info):
+    """Construit le libellé 'Prénom Nom' à partir des données d'un utilisateur."""
+    # Un champ présent mais à None est traité comme absent
+    return f"{user_info.get('first_name') or 'Utilisateur'} {user_info.get('last_name') or ''}".strip()
 
 @st.cache_data(ttl=30)
 def get_transactions_for_house(house_id):
@@ -189,20 +223,27 @@ def get_transactions_for_house(house_id):
         
         # Jointures avec les utilisateurs et catégories (en utilisant les fonctions utilitaires)
         categories = get_categories()
-        
-        df['category_name'] = df['category'].apply(lambda cid: categories.get(cid, 'N/A'))
-        df['full_name'] = df['user_id'].apply(get_user_name_by_id)
+        df['category_name'] = df['category'].map(categories).fillna('N/A')
+        # Le nom de l'auteur est enregistré sur la transaction ; les utilisateurs de la maison
+        # ne sont chargés (une seule fois) que pour les anciennes transactions qui ne l'ont pas
+        full_names = df.get('user_full_name', pd.Series(None, index=df.index, dtype=object))
+        if full_names.isna().any():
+            users = get_all_users_for_house(house_id)
+            user_names = {uid: format_user_name(info) for uid, info in users.items()}
+            full_names = full_names.fillna(df['user_id'].map(user_names)).fillna(format_user_name({}))
+        df['full_name'] = full_names
         
         # Tri
         return df.sort_values('date', ascending=False)
     
-    except Exception as e:
-        # st.error(f"Erreur lors de la récupération des transactions: {e}")
+    except Exception:
+        logger.exception("Erreur lors de la récupération des transactions de la maison %s", house_id)
         return pd.DataFrame()
 
 def get_user_transactions(house_id, user_id):
-    """Filtre les transactions de la maison pour un utilisateur donné."""
+    """Filtre les transactions de la maison pour un utilisateur donné (copie indépendante du cache)."""
     df = get_transactions_for_house(house_id)
+    if df.empty: return df
     return df[df['user_id'] == user_id].copy()
 
 # -------------------------------------------------------------------
@@ -219,7 +260,8 @@ def delete_transaction(transaction_id, house_id, user_id, user_role):
         # 1. Vérifier les permissions
         # On utilise une requête directe pour vérifier la transaction si le cache n'est pas fiable/disponible
         doc_ref = db.collection(COL_TRANSACTIONS).document(transaction_id)
-        doc = doc_ref.get()
+        # Seuls les champs utiles au contrôle des permissions sont lus
+        doc = doc_ref.get(field_paths=['user_id', 'house_id'])
         
         if not doc.exists:
              return False, "Transaction introuvable ou déjà supprimée."
@@ -250,7 +292,7 @@ def validate_advance(transaction_id, house_id, validator_user_id):
 
     try:
         doc_ref = db.collection(COL_TRANSACTIONS).document(transaction_id)
-        doc = doc_ref.get()
+        doc = doc_ref.get(field_paths=['house_id', 'type', 'statut_avance', 'amount'])
         
         if not doc.exists:
              return False, "Avance introuvable."
@@ -268,7 +310,7 @@ def validate_advance(transaction_id, house_id, validator_user_id):
         doc_ref.update({
             'statut_avance': 'validée', 
             'validator_id': validator_user_id,
-            'validated_at': datetime.now()
+            'validated_at': firestore.SERVER_TIMESTAMP
         })
         
         # Invalider le cache
@@ -282,9 +324,11 @@ def validate_advance(transaction_id, house_id, validator_user_id):
 # --- 5. Export de Données (Excel) ---
 # -------------------------------------------------------------------
 
+@st.cache_data(ttl=30)
 def generate_excel_report(df_all: pd.DataFrame, house_name: str) -> bytes:
     """
     Génère un rapport Excel structuré et lisible à partir du DataFrame de transactions.
+    Le fichier est mis en cache : il n'est reconstruit que si les transactions changent.
     """
     
     if df_all.empty:
@@ -317,8 +361,8 @@ def generate_excel_report(df_all: pd.DataFrame, house_name: str) -> bytes:
         })
         
         # Création de colonnes lisibles
-        report_df.insert(3, 'Type_Transaction', report_df['Type_Transaction_Code'].apply(lambda t: TX_TYPE_MAP.get(t, 'Autre')))
-        report_df.insert(10, 'Statut_Avance', report_df['Statut_Avance_Code'].apply(lambda s: AVANCE_STATUS.get(s, 'N/A')))
+        report_df.insert(3, 'Type_Transaction', report_df['Type_Transaction_Code'].map(TX_TYPE_MAP).fillna('Autre'))
+        report_df.insert(10, 'Statut_Avance', report_df['Statut_Avance_Code'].map(AVANCE_STATUS).fillna('N/A'))
 
         # Sélection et ordre des colonnes
         cols_final = [
@@ -340,10 +384,24 @@ def generate_excel_report(df_all: pd.DataFrame, house_name: str) -> bytes:
     output = io.BytesIO()
     # Utilisation de XlsxWriter comme moteur pour gérer les encodages
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        report_df.to_excel(writer, sheet_name='Transactions', index=False, encoding='utf-8')
+        report_df.to_excel(writer, sheet_name='Transactions', index=False)
     
     return output.getvalue()
 
+def excel_export_button(house_id, house_name, label):
+    """ Bouton de téléchargement du rapport Excel de la maison (partagé par les menus Chef de Maison et Admin). """
+    # Chargement uniquement dans l'onglet qui l'utilise (les autres onglets lisent leurs propres données)
+    df_all_transactions = get_transactions_for_house(house_id)
+    excel_data = generate_excel_report(df_all_transactions, house_name)
+
+    st.download_button(
+        label=label,
+        data=excel_data,
+        file_name=f'transactions_{house_name}_{date.today().strftime("%Y%m%d")}.xlsx',
+        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        type="primary"
+    )
+
 
 # -------------------------------------------------------------------
 # --- 6. Interfaces Utilisateur et Logique ---
@@ -393,18 +451,11 @@ def log_transaction(user_id, house_id, house_name):
                 return
 
             # LOGIQUE CRITIQUE: Classification Dépense/Avance
-            tx_type_firestore = ''
-            statut_avance = 'validée'
-            
             if transaction_type == 'Recette Exceptionnelle':
-                tx_type_firestore = 'recette_exceptionnelle'
-            
-            elif payment_method in PAYMENT_METHODS_HOUSE:
-                tx_type_firestore = 'depense_commune'
-            
-            elif payment_method in PAYMENT_METHODS_PERSONAL:
-                tx_type_firestore = 'depense_avance'
-                statut_avance = 'en_attente'
+                tx_type_firestore, statut_avance = 'recette_exceptionnelle', 'validée'
+            else:
+                # Paiement Maison = Dépense Commune, Paiement Personnel = Avance en attente
+                tx_type_firestore, statut_avance = PAYMENT_METHOD_CLASSIFICATION.get(payment_method, ('', 'validée'))
 
             # --------------------------------------------------------------------------
 
@@ -417,9 +468,14 @@ def log_transaction(user_id, house_id, house_name):
                 'description': description,
                 'payment_method': payment_method,
                 'date': datetime.combine(date_saisie, datetime.min.time()),
-                'created_at': datetime.now(),
+                'created_at': firestore.SERVER_TIMESTAMP, # Horodatage fixé par le serveur Firestore
                 'statut_avance': statut_avance 
             }
+            # Nom dénormalisé pour éviter la jointure utilisateurs ; omis sans prénom ni nom réels,
+            # pour que le chargement des transactions se rabatte sur le document utilisateur
+            user_data = st.session_state.get('user_data') or {}
+            if user_data.get('first_name') or user_data.get('last_name'):
+                transaction_data['user_full_name'] = format_user_name(user_data)
             
             try:
                 # Enregistrement Firestore réel
@@ -430,8 +486,9 @@ def log_transaction(user_id, house_id, house_name):
                 msg = f"Transaction enregistrée ! Type: {TX_TYPE_MAP.get(tx_type_firestore)}"
                 if statut_avance == 'en_attente':
                     msg += " (⚠️ **Avance en attente de validation** par le Chef de Maison)."
+                # Pas de st.rerun() : le formulaire se vide seul et l'onglet Historique, rendu après
+                # celui-ci dans la même exécution, relit les transactions depuis le cache invalidé.
                 st.success(msg)
-                st.rerun()
 
             except Exception as e:
                 st.error(f"Erreur d'enregistrement dans Firestore : {e}")
@@ -469,12 +526,12 @@ def user_transaction_history_and_cancellation(house_id, user_id, user_role):
         st.info("Vous n'avez pas encore saisi de transactions.")
         return
 
-    # Préparer le DataFrame pour l'affichage
-    display_df = user_transactions_df.copy()
+    # Préparer le DataFrame pour l'affichage (get_user_transactions renvoie déjà une copie)
+    display_df = user_transactions_df
     display_df['Montant'] = display_df['amount'].apply(lambda x: f"{x:,.2f} €")
-    display_df['Type'] = display_df['type'].apply(lambda t: TX_TYPE_MAP.get(t, 'Autre'))
+    display_df['Type'] = display_df['type'].map(TX_TYPE_MAP).fillna('Autre')
     display_df['Catégorie'] = display_df['category_name']
-    display_df['Statut Avance'] = display_df['statut_avance'].apply(lambda s: AVANCE_STATUS.get(s, 'N/A'))
+    display_df['Statut Avance'] = display_df['statut_avance'].map(AVANCE_STATUS).fillna('N/A')
     display_df['Transaction_ID'] = display_df['id']
 
     cols_to_show = ['date', 'Type', 'Montant', 'Catégorie', 'description', 'payment_method', 'Statut Avance', 'Transaction_ID']
@@ -489,18 +546,25 @@ def user_transaction_history_and_cancellation(house_id, user_id, user_role):
     st.markdown("#### 🗑️ Annuler une Saisie Récente")
     st.caption("Vous pouvez annuler toute transaction que vous avez saisie.")
     
-    annulable_df = display_df.copy()
+    annulable_df = display_df
 
     if not annulable_df.empty:
         with st.form("form_annulation_transaction", clear_on_submit=True):
             col1, col2 = st.columns([3, 1])
             
+            # Libellés construits en une seule passe (au lieu d'un filtrage du DataFrame par option)
+            option_labels = {
+                tx_id: f"{tx_date.strftime('%Y-%m-%d')} - {montant} ({description[:30]}...)"
+                for tx_id, tx_date, montant, description in zip(
+                    annulable_df['Transaction_ID'], annulable_df['Date'], annulable_df['Montant'], annulable_df['Description']
+                )
+            }
+
             # S'assurer que seules les transactions de cet utilisateur sont dans la liste
             transaction_to_delete = col1.selectbox(
                 "Sélectionnez la transaction à annuler :",
-                options=annulable_df['Transaction_ID'].tolist(),
-                # Utiliser .dt.strftime pour formater la date si c'est un datetime
-                format_func=lambda id: f"{annulable_df[annulable_df['Transaction_ID'] == id]['Date'].iloc[0].strftime('%Y-%m-%d')} - {annulable_df[annulable_df['Transaction_ID'] == id]['Montant'].iloc[0]} ({annulable_df[annulable_df['Transaction_ID'] == id]['Description'].iloc[0][:30]}...)"
+                options=list(option_labels),
+                format_func=option_labels.get
             )
             
             submitted = col2.form_submit_button("Annuler la Dépense", type="secondary")
@@ -560,9 +624,9 @@ def admin_transaction_management(house_id, admin_user_id, admin_user_role):
     # Préparation du DataFrame pour l'affichage
     display_df = df_all.copy()
     display_df['Montant'] = display_df['amount'].apply(lambda x: f"{x:,.2f} €")
-    display_df['Type'] = display_df['type'].apply(lambda t: TX_TYPE_MAP.get(t, 'Autre'))
+    display_df['Type'] = display_df['type'].map(TX_TYPE_MAP).fillna('Autre')
     display_df['Catégorie'] = display_df['category_name']
-    display_df['Statut Avance'] = display_df['statut_avance'].apply(lambda s: AVANCE_STATUS.get(s, 'N/A'))
+    display_df['Statut Avance'] = display_df['statut_avance'].map(AVANCE_STATUS).fillna('N/A')
     display_df['Transaction_ID'] = display_df['id']
 
     cols_to_show = ['date', 'Type', 'Montant', 'full_name', 'Catégorie', 'description', 'payment_method', 'Statut Avance', 'Transaction_ID']
@@ -583,10 +647,17 @@ def admin_transaction_management(house_id, admin_user_id, admin_user_role):
     with st.form("form_admin_annulation_transaction", clear_on_submit=True):
         col1, col2 = st.columns([3, 1])
         
+        option_labels = {
+            tx_id: f"{tx_date.strftime('%Y-%m-%d')} - {montant} ({saisi_par})"
+            for tx_id, tx_date, montant, saisi_par in zip(
+                display_df['Transaction_ID'], display_df['Date'], display_df['Montant'], display_df['Saisi par']
+            )
+        }
+
         transaction_to_delete = col1.selectbox(
             "Sélectionnez la transaction à annuler :",
-            options=display_df['Transaction_ID'].tolist(),
-            format_func=lambda id: f"{display_df[display_df['Transaction_ID'] == id]['Date'].iloc[0].strftime('%Y-%m-%d')} - {display_df[display_df['Transaction_ID'] == id]['Montant'].iloc[0]} ({display_df[display_df['Transaction_ID'] == id]['Saisi par'].iloc[0]})"
+            options=list(option_labels),
+            format_func=option_labels.get
         )
         
         submitted = col2.form_submit_button("Annuler la Transaction SÉLECTIONNÉE", type="secondary")
@@ -615,11 +686,12 @@ def advance_validation_interface(house_id, validator_user_id):
     # Récupérer toutes les transactions de la maison (Firestore)
     df_all = get_transactions_for_house(house_id)
     
-    # Filtrer uniquement les avances en attente
-    display_df = df_all[
-        (df_all['type'] == 'depense_avance') & 
-        (df_all['statut_avance'] == 'en_attente')
-    ].copy()
+    # Filtrer uniquement les avances en attente, en ne copiant que les colonnes affichées
+    if df_all.empty:
+        display_df = df_all
+    else:
+        pending_mask = (df_all['type'] == 'depense_avance') & (df_all['statut_avance'] == 'en_attente')
+        display_df = df_all.loc[pending_mask, ['date', 'amount', 'full_name', 'description', 'payment_method', 'id']].copy()
     
     if display_df.empty:
         st.success("Aucune avance de fonds en attente de validation pour le moment.")
@@ -648,10 +720,17 @@ def advance_validation_interface(house_id, validator_user_id):
     with st.form("form_validation_avance"):
         col1, col2 = st.columns([3, 1])
         
+        option_labels = {
+            tx_id: f"[{tx_id[:6]}...] {montant} par {avance_par}"
+            for tx_id, montant, avance_par in zip(
+                display_df['Transaction_ID'], display_df['Montant'], display_df['Avancé par']
+            )
+        }
+
         transaction_to_validate = col1.selectbox(
             "Sélectionnez la transaction à valider :",
-            options=display_df['Transaction_ID'].tolist(),
-            format_func=lambda id: f"[{id[:6]}...] {display_df[display_df['Transaction_ID'] == id]['Montant'].iloc[0]} par {display_df[display_df['Transaction_ID'] == id]['Avancé par'].iloc[0]}"
+            options=list(option_labels),
+            format_func=option_labels.get
         )
         
         submitted = col2.form_submit_button("Valider l'Avance", type="primary")
@@ -678,8 +757,6 @@ def admin_interface():
     house_id = st.session_state['house_id']
     user_id = st.session_state['user_id']
     house_name = get_house_name(house_id)
-    
-    df_all_transactions = get_transactions_for_house(house_id)
 
 
     if role == 'chef_de_maison':
@@ -702,15 +779,7 @@ def admin_interface():
             
             st.markdown("### 📊 Export des Données")
             
-            excel_data = generate_excel_report(df_all_transactions, house_name)
-            
-            st.download_button(
-                label="Exporter toutes les transactions en Excel",
-                data=excel_data,
-                file_name=f'transactions_{house_name}_{date.today().strftime("%Y%m%d")}.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                type="primary"
-            )
+            excel_export_button(house_id, house_name, "Exporter toutes les transactions en Excel")
             st.caption("Le fichier Excel contient toutes les données brutes, y compris les ID et les codes de statut, pour une analyse approfondie.")
 
             st.markdown("---")
@@ -730,15 +799,7 @@ def admin_interface():
         elif admin_tab == 'Rapports Globaux':
              st.info("Rapports consolidés sur toutes les maisons et l'activité générale. (À implémenter)")
              st.markdown("### 📊 Export des Données de la Maison")
-             excel_data = generate_excel_report(df_all_transactions, house_name)
-            
-             st.download_button(
-                label=f"Exporter les transactions de {house_name} en Excel",
-                data=excel_data,
-                file_name=f'transactions_{house_name}_{date.today().strftime("%Y%m%d")}.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                type="primary"
-             )
+             excel_export_button(house_id, house_name, f"Exporter les transactions de {house_name} en Excel")
 
              
 
@@ -746,44 +807,89 @@ def admin_interface():
 # --- 7. Fonctions d'Authentification (Firestore) ---
 # -------------------------------------------------------------------
 
+# Champs du document utilisateur nécessaires à la connexion
+USER_LOGIN_FIELDS = ['password', 'house_id', 'role', 'first_name', 'last_name']
+
 def get_user_by_username(username):
     """ Récupère les données utilisateur à partir du nom d'utilisateur. """
-    if not db: return None
+    if not db or not username: return None
     try:
         # Recherche par nom d'utilisateur
-        query = db.collection(COL_USERS).where('username', '==', username).limit(1).stream()
+        query = db.collection(COL_USERS).where('username', '==', username).select(USER_LOGIN_FIELDS).limit(1).stream()
         for doc in query:
             user_data = doc.to_dict()
             user_data['id'] = doc.id
             return user_data
         return None
-    except Exception as e:
-        #st.error(f"Erreur de recherche utilisateur: {e}")
+    except Exception:
+        logger.exception("Erreur de recherche utilisateur")
         return None
 
+@st.cache_resource(show_spinner=False)
+def get_login_attempts_registry():
+    """ Registre partagé par toutes les sessions du processus : (verrou, {nom d'utilisateur: (échecs, expiration)}). """
+    return threading.Lock(), {}
+
+def _prune_login_attempts(attempts, now):
+    """ Retire les entrées expirées du registre (appelée verrou détenu). """
+    for name in [name for name, (_, expires_at) in attempts.items() if now >= expires_at]:
+        del attempts[name]
+
+def is_login_locked(username):
+    """ Indique si le nom d'utilisateur est temporairement verrouillé après trop d'échecs. """
+    lock, attempts = get_login_attempts_registry()
+    with lock:
+        _prune_login_attempts(attempts, datetime.now())
+        failures, _ = attempts.get(username, (0, None))
+        return failures >= LOGIN_MAX_ATTEMPTS
+
+def register_failed_login(username):
+    """ Comptabilise un échec de connexion et verrouille temporairement le nom d'utilisateur au-delà du seuil. """
+    lock, attempts = get_login_attempts_registry()
+    with lock:
+        now = datetime.now()
+        _prune_login_attempts(attempts, now)
+        # Les échecs ne sont cumulés que sur LOGIN_LOCKOUT_SECONDS à compter du premier
+        failures, expires_at = attempts.get(username, (0, now + timedelta(seconds=LOGIN_LOCKOUT_SECONDS)))
+        failures += 1
+        if failures >= LOGIN_MAX_ATTEMPTS:
+            # Le verrouillage dure LOGIN_LOCKOUT_SECONDS à partir du dernier échec
+            expires_at = now + timedelta(seconds=LOGIN_LOCKOUT_SECONDS)
+        attempts[username] = (failures, expires_at)
+
+def clear_failed_logins(username):
+    """ Réinitialise le compteur d'échecs après une connexion réussie. """
+    lock, attempts = get_login_attempts_registry()
+    with lock:
+        attempts.pop(username, None)
+
 def handle_login(username, password):
     """ Logique de connexion et vérification des rôles (Firestore Implémentation). """
     
+    # Vérifié avant toute lecture Firestore et tout calcul bcrypt
+    if is_login_locked(username):
+        st.error("Trop de tentatives de connexion. Veuillez réessayer dans quelques instants.")
+        return
+    
     user_info = get_user_by_username(username)
     
     if user_info:
         stored_hashed_password = user_info.get('password')
         
         # Vérification du mot de passe
-        is_default_password = (password == DEFAULT_PASSWORD)
-        
         password_is_valid = False
-        if is_default_password:
-             password_is_valid = True # Le mot de passe par défaut est toujours accepté
-        elif stored_hashed_password:
+        if stored_hashed_password:
              try:
                  password_is_valid = bcrypt.checkpw(password.encode('utf-8'), stored_hashed_password.encode('utf-8'))
              except Exception:
-                  password_is_valid = False # Échoue si le hash n'est pas bon ou manquant
+                  password_is_valid = False # Échoue si le hash n'est pas bon
+        else:
+             # Le mot de passe par défaut n'est accepté que pour un compte sans hash (première connexion)
+             password_is_valid = (password == DEFAULT_PASSWORD)
 
         if password_is_valid:
-            # Si c'est le mot de passe par défaut, forcer le changement
-            must_change = is_default_password and stored_hashed_password # Seulement si un hash existe déjà, sinon on assume que l'utilisateur a créé son propre mdp
+            # Sans hash enregistré, l'utilisateur s'est connecté avec le mot de passe par défaut : forcer le changement
+            must_change = not stored_hashed_password
             
             st.session_state['logged_in'] = True
             st.session_state['user_id'] = user_info['id']
@@ -791,10 +897,13 @@ def handle_login(username, password):
             st.session_state['role'] = user_info['role']
             st.session_state['user_data'] = {'first_name': user_info.get('first_name'), 'last_name': user_info.get('last_name')}
             st.session_state['must_change_password'] = must_change
+            clear_failed_logins(username)
             st.rerun()
         else:
+            register_failed_login(username)
             st.error("Mot de passe incorrect.")
     else:
+        # Pas d'entrée pour un nom inconnu : le registre reste borné aux comptes existants
         st.error("Nom d'utilisateur inconnu.")
         
 def password_reset_interface(user_id):
@@ -810,7 +919,7 @@ def password_reset_interface(user_id):
             if new_password == confirm_password and len(new_password) >= 6:
                 try:
                     # Chiffrement du nouveau mot de passe
-                    hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                    hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_COST)).decode('utf-8')
                     
                     # Mise à jour Firestore
                     db.collection(COL_USERS).document(user_id).update({'password': hashed_password})
@@ -835,22 +944,24 @@ def login_interface():
         if submitted:
             handle_login(username, password)
             
-    st.caption("Note: Assurez-vous d'avoir des utilisateurs dans la collection `smmd_users` de Firestore. Le mot de passe par défaut est `first123`.")
+    st.caption("Note: Assurez-vous d'avoir des utilisateurs dans la collection `smmd_users` de Firestore.")
 
 # -------------------------------------------------------------------
 # --- 8. Lancement de l'Application ---
 # -------------------------------------------------------------------
 
 def main():
-    # Initialisation des variables de session
-    if 'logged_in' not in st.session_state:
-        st.session_state['logged_in'] = False
-        st.session_state['user_id'] = None
-        st.session_state['role'] = None
-
+    # Initialisation des variables de session (une seule fois par session, ignorée aux réexécutions suivantes)
     if not st.session_state.get('initialized'):
-        # Le code d'initialisation en haut du fichier gère les erreurs et affiche un message.
-        return
+        if 'logged_in' not in st.session_state:
+            st.session_state['logged_in'] = False
+            st.session_state['user_id'] = None
+            st.session_state['role'] = None
+
+        if db is None:
+            # Le code d'initialisation en haut du fichier gère les erreurs et affiche un message.
+            return
+        st.session_state['initialized'] = True
 
     if not st.session_state['logged_in']:
         login_interface()
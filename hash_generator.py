@@ -1,18 +1,32 @@
 import bcrypt # 👈 AJOUTEZ CETTE LIGNE
-import sys # Pour sys.exit(1) si vous l'avez ajouté précédemment
+import getpass # Saisie masquée du mot de passe
+import os # Pour lire BCRYPT_COST (même variable que app.py)
+import sys # Pour sys.exit(1) si le mot de passe est vide
 
-# 🚨🚨 MOT DE PASSE EN CLAIR INTÉGRÉ 🚨🚨
-# Le mot de passe choisi est 'florent1234'.
-password = "florent1234" 
+# Le mot de passe n'est plus écrit en clair dans ce fichier : il est saisi au lancement
+# (jamais en argument, pour qu'il n'apparaisse ni dans l'historique du shell ni dans la liste des processus).
+# Seul le hash produit est destiné à être stocké dans Firebase.
+password = getpass.getpass("Mot de passe à hacher : ")
 
 if not password:
     print("ERREUR : Le mot de passe est vide.")
-
-print(f"Mot de passe en clair à hacher : '{password}'")
+    sys.exit(1)
 
 # Encodage, hachage et décodage
 password_bytes = password.encode('utf-8')
-hashed_password_bytes = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+# Même validation que app.py : défaut 12, au moins 10 (4 si BCRYPT_ALLOW_LOW_COST=1), au plus 31
+raw_cost = os.environ.get('BCRYPT_COST', '12')
+try:
+    bcrypt_cost = int(raw_cost)
+except ValueError:
+    print(f"ATTENTION : BCRYPT_COST invalide ({raw_cost!r}), utilisation de 12.")
+    bcrypt_cost = 12
+min_cost = 4 if os.environ.get('BCRYPT_ALLOW_LOW_COST') == '1' else 10
+if not min_cost <= bcrypt_cost <= 31:
+    clamped_cost = min(max(bcrypt_cost, min_cost), 31)
+    print(f"ATTENTION : BCRYPT_COST={bcrypt_cost} hors de l'intervalle [{min_cost}, 31], utilisation de {clamped_cost}.")
+    bcrypt_cost = clamped_cost
+hashed_password_bytes = bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds=bcrypt_cost))
 hashed_password_str = hashed_password_bytes.decode('utf-8')
 
 print("\n" + "=" * 60)
@@ -8,6 +8,12 @@ export STREAMLIT_SERVER_PORT="$PORT"
 export STREAMLIT_SERVER_ENABLE_WEBSOCKETS=true
 export STREAMLIT_SERVER_ENABLE_CORS=false
 export STREAMLIT_SERVER_ENABLE_XSRF_PROTECTION=false
+# Pas de surveillance des fichiers sources en production (équivalent du "reloader" de développement)
+export STREAMLIT_SERVER_FILE_WATCHER_TYPE=none
+export STREAMLIT_SERVER_RUN_ON_SAVE=false
+export STREAMLIT_SERVER_HEADLESS=true
+# Pas de traces d'exception détaillées envoyées au navigateur (équivalent du mode "debug" désactivé)
+export STREAMLIT_CLIENT_SHOW_ERROR_DETAILS=false
 
 # 2. Exécution de l'application Streamlit avec le port dynamique de Render
 streamlit run app.py
\ No newline at end of file